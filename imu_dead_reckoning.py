@@ -1,5 +1,5 @@
 import numpy as np
-from collections import deque
+from collections import deque, namedtuple
 import logging
 import math
 import time
@@ -9,6 +9,129 @@ logger = logging.getLogger(__name__)
 if not logging.getLogger().handlers:
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
+# Per-sample diagnostics kept by IMUDeadReckoningFixed, stored one numpy column per field.
+# Timestamps need float64 (epoch seconds); everything else is display-grade, so float32.
+HISTORY_FIELDS = (
+    ('t', np.float64),
+    ('pos_x', np.float32),
+    ('pos_y', np.float32),
+    ('vel_x', np.float32),
+    ('vel_y', np.float32),
+    ('speed', np.float32),
+    ('acc_mag', np.float32),
+    ('gyro_mag', np.float32),
+    ('is_stationary', bool),
+    ('heading_deg', np.float32),
+)
+
+_INV_TAU = 1.0 / math.tau
+
+# Flat, immutable snapshot returned by get_state_fast() / update_fast(); get_state()
+# builds the nested JSON-style dict from the same fields
+TrackerState = namedtuple(
+    'TrackerState', 'x y vx vy speed heading_rad is_stationary last_timestamp')
+
+# Default cap on retained history samples (~16 min at 100 Hz); oldest are overwritten
+HISTORY_MAXLEN = 100000
+
+
+class _WindowStats:
+    """
+    Sliding window of the last maxlen samples with O(1) population std.
+
+    Keeps a running sum and sum of squares next to the samples; the sums are
+    rebuilt from the window every RESUM_EVERY appends so rounding from the
+    add/subtract pairs cannot accumulate, and as soon as they go non-finite
+    so a NaN/inf sample stops counting once it leaves the window.
+    """
+    RESUM_EVERY = 1024
+
+    def __init__(self, maxlen):
+        self.values = deque(maxlen=maxlen)
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._appends = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, x):
+        values = self.values
+        if len(values) == values.maxlen:
+            old = values[0]
+            self._sum -= old
+            self._sumsq -= old * old
+        values.append(x)
+        self._sum += x
+        self._sumsq += x * x
+        self._appends += 1
+        if not math.isfinite(self._sumsq):
+            # plain sum() yields inf/NaN where fsum() would raise OverflowError
+            # (finite but huge samples), so std() can propagate it instead
+            self._sum = sum(values)
+            self._sumsq = sum(v * v for v in values)
+            self._appends = 0
+        elif self._appends >= self.RESUM_EVERY:
+            try:
+                self._sum = math.fsum(values)
+                self._sumsq = math.fsum(v * v for v in values)
+            except OverflowError:
+                self._sum = sum(values)
+                self._sumsq = sum(v * v for v in values)
+            self._appends = 0
+
+    def std(self):
+        n = len(self.values)
+        if n == 0:
+            return 0.0
+        mean = self._sum / n
+        var = self._sumsq / n - mean * mean
+        if var > 0.0:
+            return math.sqrt(var)
+        # NaN/inf propagate (and fail the caller's threshold test, like np.std)
+        return var if not math.isfinite(var) else 0.0
+
+
+class _WindowRange:
+    """
+    Sliding window of the last maxlen samples with amortized O(1) max - min.
+
+    Keeps two monotonic deques of (index, value): decreasing values for the
+    max and increasing values for the min, so each front is the current
+    extreme. Samples dominated by a newer one can never be the extreme again
+    and are dropped on append.
+    """
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self._count = 0
+        self._max = deque()
+        self._min = deque()
+
+    def __len__(self):
+        return min(self._count, self.maxlen)
+
+    def append(self, x):
+        i = self._count
+        hi = self._max
+        while hi and hi[-1][1] <= x:
+            hi.pop()
+        hi.append((i, x))
+        lo = self._min
+        while lo and lo[-1][1] >= x:
+            lo.pop()
+        lo.append((i, x))
+        # the window slides by one sample per append, so at most one front expires
+        oldest = i - self.maxlen
+        if hi[0][0] <= oldest:
+            hi.popleft()
+        if lo[0][0] <= oldest:
+            lo.popleft()
+        self._count = i + 1
+
+    def range(self):
+        return self._max[0][1] - self._min[0][1]
+
 
 class IMUDeadReckoningFixed:
     """
@@ -24,15 +147,28 @@ class IMUDeadReckoningFixed:
     If your source timestamp is in ms, convert to seconds before calling update.
     """
 
+    # Gyro bias EMA weight while stationary, and its complement
+    GYRO_BIAS_ALPHA = 0.99
+    _GYRO_BIAS_BETA = 1.0 - GYRO_BIAS_ALPHA
+
     def __init__(self,
                  initial_position=(0.0, 0.0),
                  initial_heading_rad=0.0,
-                 sample_rate_hz=50.0):
-        # State
-        self.position = np.array(initial_position, dtype=float)
-        self.velocity = np.array([0.0, 0.0], dtype=float)  # m/s in world frame
+                 sample_rate_hz=50.0,
+                 history_maxlen=HISTORY_MAXLEN):
+        # State. Vectors are kept as plain float attributes (numpy dispatch on
+        # 2-3 element arrays costs more than the arithmetic); the position,
+        # velocity, gravity, bias and hp_state properties expose them as arrays.
+        self._px, self._py = (float(c) for c in initial_position)
+        self._vx = self._vy = 0.0  # m/s in world frame
         self.heading = float(initial_heading_rad)          # radians (yaw)
+        self._trig_heading = None   # heading that _cos_h/_sin_h were computed for
+        self._deg_heading = None    # heading that _heading_deg was computed for
+        self._heading_deg = 0.0
+        self._cos_h = 1.0
+        self._sin_h = 0.0
         self.last_timestamp = None
+        self.dropped_samples = 0   # samples skipped for NaN/inf readings
 
         # Keep origin for optional snap-to-origin when back at start
         self.origin = np.array(initial_position, dtype=float)
@@ -42,19 +178,19 @@ class IMUDeadReckoningFixed:
         self.sample_hz = float(sample_rate_hz)
         win_seconds = 0.5
         self.win_len = max(4, int(round(self.sample_hz * win_seconds)))
-        self.accel_mag_buf = deque(maxlen=self.win_len)
-        self.gyro_mag_buf = deque(maxlen=self.win_len)
+        self.accel_mag_buf = _WindowStats(self.win_len)
+        self.gyro_mag_buf = _WindowStats(self.win_len)
 
         # Bias estimates (updated during stationary)
-        self.accel_bias = np.zeros(3)
-        self.gyro_bias = np.zeros(3)
+        self._abx = self._aby = self._abz = 0.0
+        self._gbx = self._gby = self._gbz = 0.0
 
         # Gravity estimate (low-pass on accelerometer when near gravity)
-        self.gravity = np.array([0.0, 0.0, 9.81])
+        self._set_gravity(0.0, 0.0, 9.81)
         self.gravity_alpha = 0.995  # slow adapt
 
         # High-pass filter memory for accel to remove residual low-freq components
-        self.hp_state = np.zeros(3)
+        self._hpx = self._hpy = self._hpz = 0.0
         self.hp_alpha = 0.92  # closer to 1 -> less high-pass (tunable: 0.85-0.98)
 
         # Magnetometer fusion
@@ -74,10 +210,8 @@ class IMUDeadReckoningFixed:
         self.user_gravity_threshold_y = 0.7        # was 0.5
 
         # Buffers for peak detection (store recent values to detect peaks)
-        self.gravity_buf = deque(maxlen=self.win_len)      # Store gravity magnitude
-        self.user_acc_buf = deque(maxlen=self.win_len)     # Store user acceleration magnitude
-        self.gravity_x_buf = deque(maxlen=self.win_len)    # Store gravity X component
-        self.gravity_y_buf = deque(maxlen=self.win_len)    # Store gravity Y component
+        self.gravity_buf = _WindowRange(self.win_len)      # Store gravity magnitude
+        self.user_acc_buf = _WindowRange(self.win_len)     # Store user acceleration magnitude
 
         # Counters
         self.stationary_windows = 0
@@ -86,12 +220,18 @@ class IMUDeadReckoningFixed:
         self.no_motion_timeout = 3.0  # seconds of no motion => force freeze
 
         # Integration safety and damping
+        self.accel_deadzone = 0.01  # m/s^2 - world-frame accel components below this are dropped
         self.velocity_damping = 0.7
         self.velocity_threshold = 0.03  # m/s (tunable: 0.02-0.05) - avoid tiny drifts
         self.max_speed = 4.0  # m/s
 
-        # Diagnostics / history
-        self.history = []
+        # Diagnostics / history (columns grow by doubling up to history_maxlen,
+        # then wrap as a ring over the oldest samples; see get_history)
+        self.history_maxlen = max(1, int(history_maxlen))
+        self.history_len = 0
+        self._history_next = 0
+        capacity = min(1024, self.history_maxlen)
+        self._history = {name: np.empty(capacity, dtype=dtype) for name, dtype in HISTORY_FIELDS}
 
         logger.info("IMUDeadReckoningFixed initialized")
         logger.info(f"  sample_hz={self.sample_hz}, window_len={self.win_len}")
@@ -103,21 +243,37 @@ class IMUDeadReckoningFixed:
     # ----------------------------
     # Utility helpers
     # ----------------------------
-    @staticmethod
-    def _vec_norm(v):
-        return float(np.linalg.norm(v))
-
-    @staticmethod
-    def _clamp_speed(v, max_speed):
-        speed = np.linalg.norm(v)
-        if speed > max_speed:
-            return v * (max_speed / speed)
-        return v
+    def _set_gravity(self, gx, gy, gz):
+        # magnitude is cached here; gravity only changes on the EMA updates,
+        # not on every sample
+        self._grx, self._gry, self._grz = gx, gy, gz
+        self._gravity_mag = math.sqrt(gx * gx + gy * gy + gz * gz)
+
+    def _update_gravity(self, ax, ay, az):
+        # EMA: gravity = alpha * gravity + (1 - alpha) * acc
+        alpha = self._gravity_alpha
+        beta = self._one_minus_gravity_alpha
+        self._set_gravity(self._grx * alpha + ax * beta,
+                          self._gry * alpha + ay * beta,
+                          self._grz * alpha + az * beta)
 
     @staticmethod
     def _wrap_angle(angle):
-        # normalize to [-pi, pi)
-        return math.atan2(math.sin(angle), math.cos(angle))
+        # normalize to [-pi, pi]; per-sample heading changes are tiny, so the
+        # value is almost always already in range or one turn out
+        if -math.pi <= angle <= math.pi:
+            return angle
+        if not math.isfinite(angle):
+            # NaN/inf cannot be wrapped (math.floor would raise); pass it through
+            return angle
+        if angle > math.pi:
+            angle -= math.tau
+        else:
+            angle += math.tau
+        if -math.pi <= angle <= math.pi:
+            return angle
+        # far out of range (e.g. heading set externally): full modulo wrap
+        return angle - math.tau * math.floor((angle + math.pi) * _INV_TAU)
 
     # ----------------------------
     # Core update function
@@ -130,40 +286,136 @@ class IMUDeadReckoningFixed:
         Call at high rate (e.g., 50 Hz). timestamp_s is seconds (float).
         Returns state dict.
         """
+        self._step(accel_x, accel_y, accel_z,
+                   gyro_x, gyro_y, gyro_z,
+                   timestamp_s,
+                   self._mag_heading(mag_x, mag_y, mag_z))
+        return self.get_state()
+
+    def update_fast(self, accel_x, accel_y, accel_z,
+                    gyro_x, gyro_y, gyro_z,
+                    timestamp_s,
+                    mag_x=None, mag_y=None, mag_z=None):
+        """Same as update(), but returns a TrackerState instead of building the state dict."""
+        self._step(accel_x, accel_y, accel_z,
+                   gyro_x, gyro_y, gyro_z,
+                   timestamp_s,
+                   self._mag_heading(mag_x, mag_y, mag_z))
+        return self.get_state_fast()
+
+    @staticmethod
+    def _mag_heading(mag_x, mag_y, mag_z):
+        if mag_x is not None and mag_y is not None and mag_z is not None:
+            # Simple heading from device X/Y (assuming mostly upright)
+            return math.atan2(float(mag_y), float(mag_x))
+        return None
+
+    def update_batch(self, accel, gyro, timestamps_s, mag=None):
+        """
+        Feed N samples at once, e.g. to replay a log or catch up on a backlog.
+
+        Same result as calling update() on each row in order, without building
+        a state dict per sample. Per-sample output is in get_history().
+
+        Args:
+            accel: (N, 3) accelerometer (m/s^2)
+            gyro: (N, 3) angular rate (rad/s)
+            timestamps_s: (N,) timestamps in seconds
+            mag: optional (N, 3) magnetometer (uT)
+
+        Returns the state dict after the last sample.
+        """
+        # Convert once up front so the loop works on plain Python floats.
+        # Shapes are checked, not reshaped: a transposed (3, N) input would
+        # otherwise reshape into N rows of scrambled samples.
+        accel = np.asarray(accel, dtype=float)
+        gyro = np.asarray(gyro, dtype=float)
+        timestamps_s = np.asarray(timestamps_s, dtype=float)
+        if accel.ndim != 2 or accel.shape[1] != 3:
+            raise ValueError("accel must have shape (N, 3)")
+        if gyro.ndim != 2 or gyro.shape[1] != 3:
+            raise ValueError("gyro must have shape (N, 3)")
+        if timestamps_s.ndim != 1:
+            raise ValueError("timestamps_s must have shape (N,)")
+        if not (len(accel) == len(gyro) == len(timestamps_s)):
+            raise ValueError("accel, gyro and timestamps_s must have the same number of samples")
+        accel = accel.tolist()
+        gyro = gyro.tolist()
+        timestamps_s = timestamps_s.tolist()
+
+        if mag is None:
+            for (ax, ay, az), (gx, gy, gz), t in zip(accel, gyro, timestamps_s):
+                self._step(ax, ay, az, gx, gy, gz, t, None)
+        else:
+            mag = np.asarray(mag, dtype=float)
+            if mag.ndim != 2 or mag.shape[1] != 3:
+                raise ValueError("mag must have shape (N, 3)")
+            if len(mag) != len(timestamps_s):
+                raise ValueError("mag must have the same number of samples as accel")
+            mag = mag.tolist()
+            for (ax, ay, az), (gx, gy, gz), t, (mx, my, _) in zip(accel, gyro, timestamps_s, mag):
+                self._step(ax, ay, az, gx, gy, gz, t, math.atan2(my, mx))
+
+        return self.get_state()
+
+    def _step(self, accel_x, accel_y, accel_z,
+              gyro_x, gyro_y, gyro_z,
+              timestamp_s,
+              mag_heading):
+        # mag_heading is resolved by the caller (None without a magnetometer),
+        # so the per-sample path does a single None check
+        ts = float(timestamp_s)
+
+        # Raw readings as Python floats
+        accel_x = float(accel_x)
+        accel_y = float(accel_y)
+        accel_z = float(accel_z)
+        gyro_x = float(gyro_x)
+        gyro_y = float(gyro_y)
+        gyro_z = float(gyro_z)
+
+        # Drop non-finite samples before they reach any window, EMA or timestamp:
+        # one NaN would otherwise poison the biases and gravity for good. The sum
+        # is non-finite iff some term is (inf + -inf gives NaN).
+        if not math.isfinite(accel_x + accel_y + accel_z + gyro_x + gyro_y + gyro_z + ts):
+            self.dropped_samples += 1
+            return
+
         # initialize timestamp
         if self.last_timestamp is None:
-            self.last_timestamp = float(timestamp_s)
-            self.last_motion_time = float(timestamp_s)
+            self.last_timestamp = ts
+            self.last_motion_time = ts
             # initialize gravity with first accel reading (best-effort)
-            self.gravity = np.array([accel_x, accel_y, accel_z])
-            return self.get_state()
+            self._set_gravity(accel_x, accel_y, accel_z)
+            return
 
-        dt = float(timestamp_s) - self.last_timestamp
+        dt = ts - self.last_timestamp
         if dt <= 0 or dt > 1.0:
             # skip bad dt but update last_timestamp so we don't get stuck
-            self.last_timestamp = float(timestamp_s)
-            return self.get_state()
-
-        # Raw vectors
-        raw_acc = np.array([accel_x, accel_y, accel_z], dtype=float)
-        raw_gyro = np.array([gyro_x, gyro_y, gyro_z], dtype=float)
+            self.last_timestamp = ts
+            return
 
         # Remove biases
-        acc_unbiased = raw_acc - self.accel_bias
-        gyro_unbiased = raw_gyro - self.gyro_bias
+        ax = accel_x - self._abx
+        ay = accel_y - self._aby
+        az = accel_z - self._abz
+        gx = gyro_x - self._gbx
+        gy = gyro_y - self._gby
+        gz = gyro_z - self._gbz
 
         # Magnitudes for stationarity metrics (use accel magnitude including gravity)
-        acc_mag = np.linalg.norm(acc_unbiased)
-        gyro_mag = np.linalg.norm(gyro_unbiased)
-
-        # Compute user acceleration (linear acceleration after removing gravity)
-        linear_acc = acc_unbiased - self.gravity
-        user_acc_mag = np.linalg.norm(linear_acc)
+        acc_mag = math.sqrt(ax * ax + ay * ay + az * az)
+        gyro_mag = math.sqrt(gx * gx + gy * gy + gz * gz)
 
         # Gravity magnitude and components
-        gravity_mag = np.linalg.norm(self.gravity)
-        gravity_x = self.gravity[0]
-        gravity_y = self.gravity[1]
+        gravity_x, gravity_y, gravity_z = self._grx, self._gry, self._grz
+        gravity_mag = self._gravity_mag
+
+        # Compute user acceleration (linear acceleration after removing gravity)
+        lx = ax - gravity_x
+        ly = ay - gravity_y
+        lz = az - gravity_z
+        user_acc_mag = math.sqrt(lx * lx + ly * ly + lz * lz)
 
         # Push to rolling buffers (we use magnitude std to detect motion)
         self.accel_mag_buf.append(acc_mag)
@@ -172,50 +424,30 @@ class IMUDeadReckoningFixed:
         # Push to ReckonMe-style buffers
         self.gravity_buf.append(gravity_mag)
         self.user_acc_buf.append(user_acc_mag)
-        self.gravity_x_buf.append(abs(gravity_x))
-        self.gravity_y_buf.append(abs(gravity_y))
-
-        # Compute windowed std
-        if len(self.accel_mag_buf) >= max(3, int(self.win_len / 2)):
-            a_std = float(np.std(np.array(self.accel_mag_buf)))
-            g_std = float(np.std(np.array(self.gyro_mag_buf)))
-        else:
-            a_std = 0.0
-            g_std = 0.0
-
-        # ReckonMe-style peak detection for gravity and user acceleration
-        gravity_has_peak = False
-        user_acc_has_peak = False
-
-        if len(self.gravity_buf) >= 3:
-            gravity_arr = np.array(self.gravity_buf)
-            # Detect if there's a significant peak (max - min > threshold)
-            gravity_range = float(np.max(gravity_arr) - np.min(gravity_arr))
-            gravity_has_peak = gravity_range > self.threshold_peaks_gravity
 
-        if len(self.user_acc_buf) >= 3:
-            user_acc_arr = np.array(self.user_acc_buf)
-            # Detect if there's a significant peak (max - min > threshold)
-            user_acc_range = float(np.max(user_acc_arr) - np.min(user_acc_arr))
-            user_acc_has_peak = user_acc_range > self.threshold_peaks_user_acc
+        # Enhanced stationary detection logic (combine original + ReckonMe thresholds).
+        # The per-sample scalar tests go first: user acceleration over the step
+        # threshold or a tilted gravity vector rule stationarity out on their own,
+        # so the windowed std/peak checks only run when they could change the answer.
+        is_stationary_candidate = (
+            user_acc_mag <= self.user_acc_threshold and
+            abs(gravity_x) <= self.user_gravity_threshold_x and
+            abs(gravity_y) <= self.user_gravity_threshold_y
+        )
 
-        # Check if user acceleration exceeds step threshold
-        user_acc_exceeds_step = user_acc_mag > self.user_acc_threshold
+        # Windowed std of accel/gyro magnitudes
+        if is_stationary_candidate and len(self.accel_mag_buf) >= max(3, int(self.win_len / 2)):
+            is_stationary_candidate = (
+                self.accel_mag_buf.std() < self.accel_std_threshold and
+                self.gyro_mag_buf.std() < self.gyro_std_threshold
+            )
 
-        # Check gravity component thresholds
-        gravity_x_exceeds = abs(gravity_x) > self.user_gravity_threshold_x
-        gravity_y_exceeds = abs(gravity_y) > self.user_gravity_threshold_y
+        # ReckonMe-style peak detection: a significant peak is max - min > threshold
+        if is_stationary_candidate and len(self.gravity_buf) >= 3:
+            is_stationary_candidate = not (self.gravity_buf.range() > self.threshold_peaks_gravity)
 
-        # Enhanced stationary detection logic (combine original + ReckonMe thresholds)
-        is_stationary_candidate = (
-            (a_std < self.accel_std_threshold) and
-            (g_std < self.gyro_std_threshold) and
-            not gravity_has_peak and
-            not user_acc_has_peak and
-            not user_acc_exceeds_step and
-            not gravity_x_exceeds and
-            not gravity_y_exceeds
-        )
+        if is_stationary_candidate and len(self.user_acc_buf) >= 3:
+            is_stationary_candidate = not (self.user_acc_buf.range() > self.threshold_peaks_user_acc)
 
         if is_stationary_candidate:
             self.stationary_windows += 1
@@ -229,127 +461,306 @@ class IMUDeadReckoningFixed:
         if self.is_stationary:
             # Simple gyro bias update via exponential smoothing
             if len(self.gyro_mag_buf) > 0:
-                smooth_alpha = 0.99
-                self.gyro_bias = smooth_alpha * self.gyro_bias + (1.0 - smooth_alpha) * raw_gyro
+                smooth_alpha = self.GYRO_BIAS_ALPHA
+                smooth_beta = self._GYRO_BIAS_BETA
+                self._gbx = self._gbx * smooth_alpha + gyro_x * smooth_beta
+                self._gby = self._gby * smooth_alpha + gyro_y * smooth_beta
+                self._gbz = self._gbz * smooth_alpha + gyro_z * smooth_beta
 
             # Zero velocity update
-            self.velocity[:] = 0.0
+            vx = vy = 0.0
 
             # Slowly adapt gravity estimate toward current accel (helps if phone small tilt)
-            self.gravity = self.gravity_alpha * self.gravity + (1.0 - self.gravity_alpha) * acc_unbiased
+            self._update_gravity(ax, ay, az)
 
             # record last motion time as now (we're stationary now)
-            self.last_motion_time = float(timestamp_s)
+            self.last_motion_time = ts
         else:
             # Not stationary -> integrate and update motion timestamps
-            self.last_motion_time = float(timestamp_s)
+            self.last_motion_time = ts
 
             # Update gravity only if accel close to gravity magnitude and gyro small (to avoid corrupting gravity)
             if abs(acc_mag - 9.81) < 1.5 and gyro_mag < (5.0 * self.gyro_std_threshold):
-                self.gravity = self.gravity_alpha * self.gravity + (1.0 - self.gravity_alpha) * acc_unbiased
+                self._update_gravity(ax, ay, az)
+
+            # Gravity removal, high-pass, yaw rotation and deadzone are all done on
+            # scalars in one pass; no intermediate arrays.
+            gravity_x, gravity_y, gravity_z = self._grx, self._gry, self._grz
 
             # Compute linear acceleration by removing gravity (in device frame approximation)
-            linear_acc = acc_unbiased - self.gravity
+            lx = ax - gravity_x
+            ly = ay - gravity_y
+            lz = az - gravity_z
 
             # High-pass filter to remove low-frequency residuals (helps drift)
-            self.hp_state = self.hp_alpha * self.hp_state + (1.0 - self.hp_alpha) * linear_acc
-            accel_hp = linear_acc - self.hp_state
+            hp_alpha = self._hp_alpha
+            hp_beta = self._one_minus_hp_alpha
+            hp_x = hp_alpha * self._hpx + hp_beta * lx
+            hp_y = hp_alpha * self._hpy + hp_beta * ly
+            hp_z = hp_alpha * self._hpz + hp_beta * lz
+            self._hpx, self._hpy, self._hpz = hp_x, hp_y, hp_z
 
             # Rotate device-frame accel_hp into world XY using yaw-only rotation
             # Assuming device X forward, Y right.
-            ax_body = accel_hp[0]
-            ay_body = accel_hp[1]
-            cos_h = math.cos(self.heading)
-            sin_h = math.sin(self.heading)
+            ax_body = lx - hp_x
+            ay_body = ly - hp_y
+            # cos/sin only change when the heading does (not at all with zero yaw rate)
+            heading = self.heading
+            if heading != self._trig_heading:
+                self._cos_h = math.cos(heading)
+                self._sin_h = math.sin(heading)
+                self._trig_heading = heading
+            cos_h = self._cos_h
+            sin_h = self._sin_h
             ax_world = ax_body * cos_h - ay_body * sin_h
             ay_world = ax_body * sin_h + ay_body * cos_h
-            accel_world_2d = np.array([ax_world, ay_world])
 
-            # Deadzone small components
-            accel_world_2d[np.abs(accel_world_2d) < 0.01] = 0.0
+            # Deadzone small components (conditional expressions, no mask array or loop)
+            deadzone = self.accel_deadzone
+            ax_world = ax_world if abs(ax_world) >= deadzone else 0.0
+            ay_world = ay_world if abs(ay_world) >= deadzone else 0.0
 
             # Integrate velocity
-            self.velocity += accel_world_2d * dt
+            vx = self._vx + ax_world * dt
+            vy = self._vy + ay_world * dt
 
             # Damping if small motion (scaled with dt)
-            self.velocity *= (1.0 - (1.0 - self.velocity_damping) * dt * 10.0)
+            damping = 1.0 - self._damping_coef * dt
+            vx *= damping
+            vy *= damping
 
-            # clamp speed
-            self.velocity = self._clamp_speed(self.velocity, self.max_speed)
+            # clamp speed (squared compare, so the common unclamped case needs no sqrt)
+            max_speed = self.max_speed
+            speed_sq = vx * vx + vy * vy
+            if speed_sq > max_speed * max_speed:
+                scale = max_speed / math.sqrt(speed_sq)
+                vx *= scale
+                vy *= scale
 
-        # Heading update: integrate gyro z (yaw)
-        self.heading += (gyro_unbiased[2] * dt)  # gyro in rad/s
-        self.heading = self._wrap_angle(self.heading)
+        # From here on, state read more than once is bound to locals
+        is_stationary = self.is_stationary
 
-        # Magnetometer fusion
-        if mag_x is not None and mag_y is not None and mag_z is not None:
-            mag_vec = np.array([mag_x, mag_y, mag_z], dtype=float)
-            # Simple heading from device X/Y (assuming mostly upright)
-            mag_heading = math.atan2(mag_vec[1], mag_vec[0])
+        # Heading update: integrate gyro z (yaw)
+        heading = self._wrap_angle(self.heading + gz * dt)  # gyro in rad/s
 
-            if self.is_stationary:
+        # Magnetometer fusion (a NaN mag reading is treated as no reading)
+        if mag_heading is not None and mag_heading == mag_heading:
+            if is_stationary:
                 # When stationary, hard-reset heading to magnetometer to kill accumulated yaw drift
-                self.heading = self._wrap_angle(mag_heading)
+                heading = self._wrap_angle(mag_heading)
             else:
                 # When moving, complementary fusion
-                self.heading = self._wrap_angle(
-                    (1.0 - self.mag_alpha) * self.heading + self.mag_alpha * mag_heading
+                heading = self._wrap_angle(
+                    self._one_minus_mag_alpha * heading + self._mag_alpha * mag_heading
                 )
+        self.heading = heading
 
         # If stationary for too long, force hard stop
-        if (float(timestamp_s) - self.last_motion_time) > self.no_motion_timeout:
-            self.velocity[:] = 0.0
+        if (ts - self.last_motion_time) > self.no_motion_timeout:
+            vx = vy = 0.0
 
-        # Apply velocity cutoff
-        speed = np.linalg.norm(self.velocity)
-        if speed < self.velocity_threshold:
-            self.velocity[:] = 0.0
+        # Apply velocity cutoff (squared, to skip the sqrt)
+        velocity_threshold = self.velocity_threshold
+        if vx * vx + vy * vy < velocity_threshold * velocity_threshold:
+            vx = vy = 0.0
+        self._vx, self._vy = vx, vy
 
         # Integrate position
-        old_pos = self.position.copy()
-        self.position += self.velocity * dt
-        dist_step = np.linalg.norm(self.position - old_pos)
+        px = self._px + vx * dt
+        py = self._py + vy * dt
 
         # Optional: snap to origin when stationary and close to it
-        if self.is_stationary and self.snap_to_origin_radius is not None:
-            dist_to_origin = np.linalg.norm(self.position - self.origin)
-            if dist_to_origin < self.snap_to_origin_radius:
-                self.position[:] = self.origin
+        snap_radius = self.snap_to_origin_radius
+        if is_stationary and snap_radius is not None:
+            ox, oy = self.origin.tolist()
+            dx = px - ox
+            dy = py - oy
+            if dx * dx + dy * dy < snap_radius * snap_radius:
+                px, py = ox, oy
+        self._px, self._py = px, py
 
         # Keep history for debugging
-        self.history.append({
-            't': float(timestamp_s),
-            'pos_x': float(self.position[0]),
-            'pos_y': float(self.position[1]),
-            'vel_x': float(self.velocity[0]),
-            'vel_y': float(self.velocity[1]),
-            'speed': float(np.linalg.norm(self.velocity)),
-            'acc_mag': float(acc_mag),
-            'gyro_mag': float(gyro_mag),
-            'is_stationary': bool(self.is_stationary),
-            'heading_deg': float(math.degrees(self.heading) % 360.0)
-        })
+        i = self._history_next
+        hist = self._history
+        if i == len(hist['t']):
+            if i < self.history_maxlen:
+                self._grow_history()
+                hist = self._history
+            else:
+                i = 0
+        hist['t'][i] = ts
+        hist['pos_x'][i] = px
+        hist['pos_y'][i] = py
+        hist['vel_x'][i] = vx
+        hist['vel_y'][i] = vy
+        hist['speed'][i] = math.hypot(vx, vy)
+        hist['acc_mag'][i] = acc_mag
+        hist['gyro_mag'][i] = gyro_mag
+        hist['is_stationary'][i] = is_stationary
+        hist['heading_deg'][i] = self.heading_deg()
+        self._history_next = i + 1
+        if i >= self.history_len:
+            self.history_len = i + 1
 
         # update time
-        self.last_timestamp = float(timestamp_s)
-        return self.get_state()
+        self.last_timestamp = ts
 
     # ----------------------------
     # Accessors
     # ----------------------------
+    @property
+    def position(self):
+        """Position (m) as a new [x, y] array; assign to move the tracker."""
+        return np.array([self._px, self._py])
+
+    @position.setter
+    def position(self, value):
+        self._px, self._py = (float(c) for c in value)
+
+    @property
+    def velocity(self):
+        """World-frame velocity (m/s) as a new [vx, vy] array."""
+        return np.array([self._vx, self._vy])
+
+    @velocity.setter
+    def velocity(self, value):
+        self._vx, self._vy = (float(c) for c in value)
+
+    @property
+    def gravity(self):
+        """Gravity estimate (device frame, m/s^2) as a new array."""
+        return np.array([self._grx, self._gry, self._grz])
+
+    @gravity.setter
+    def gravity(self, value):
+        self._set_gravity(*(float(c) for c in value))
+
+    @property
+    def accel_bias(self):
+        return np.array([self._abx, self._aby, self._abz])
+
+    @accel_bias.setter
+    def accel_bias(self, value):
+        self._abx, self._aby, self._abz = (float(c) for c in value)
+
+    @property
+    def gyro_bias(self):
+        return np.array([self._gbx, self._gby, self._gbz])
+
+    @gyro_bias.setter
+    def gyro_bias(self, value):
+        self._gbx, self._gby, self._gbz = (float(c) for c in value)
+
+    @property
+    def hp_state(self):
+        return np.array([self._hpx, self._hpy, self._hpz])
+
+    @hp_state.setter
+    def hp_state(self, value):
+        self._hpx, self._hpy, self._hpz = (float(c) for c in value)
+
+    # Filter weights: setting one also refreshes the constant derived from it,
+    # so the per-sample path never recomputes them
+    @property
+    def gravity_alpha(self):
+        return self._gravity_alpha
+
+    @gravity_alpha.setter
+    def gravity_alpha(self, value):
+        self._gravity_alpha = float(value)
+        self._one_minus_gravity_alpha = 1.0 - self._gravity_alpha
+
+    @property
+    def hp_alpha(self):
+        return self._hp_alpha
+
+    @hp_alpha.setter
+    def hp_alpha(self, value):
+        self._hp_alpha = float(value)
+        self._one_minus_hp_alpha = 1.0 - self._hp_alpha
+
+    @property
+    def mag_alpha(self):
+        return self._mag_alpha
+
+    @mag_alpha.setter
+    def mag_alpha(self, value):
+        self._mag_alpha = float(value)
+        self._one_minus_mag_alpha = 1.0 - self._mag_alpha
+
+    @property
+    def velocity_damping(self):
+        return self._velocity_damping
+
+    @velocity_damping.setter
+    def velocity_damping(self, value):
+        # damping factor per sample is 1 - (1 - velocity_damping) * 10 * dt
+        self._velocity_damping = float(value)
+        self._damping_coef = (1.0 - self._velocity_damping) * 10.0
+
+    def heading_deg(self):
+        """Heading in degrees, [0, 360); cached until the heading changes."""
+        heading = self.heading
+        if heading != self._deg_heading:
+            self._heading_deg = math.degrees(heading) % 360.0
+            self._deg_heading = heading
+        return self._heading_deg
+
+    def get_state_fast(self):
+        vx, vy = self._vx, self._vy
+        return TrackerState(self._px, self._py, vx, vy, math.hypot(vx, vy),
+                            self.heading, self.is_stationary,
+                            self.last_timestamp if self.last_timestamp else None)
+
     def get_state(self):
-        speed = float(np.linalg.norm(self.velocity))
+        # all state is kept as plain Python scalars, so no per-field coercion
+        x, y = self._px, self._py
+        vx, vy = self._vx, self._vy
+        heading = self.heading
         return {
-            'position': {'x': float(self.position[0]), 'y': float(self.position[1])},
-            'velocity': {'vx': float(self.velocity[0]), 'vy': float(self.velocity[1]), 'speed': speed},
-            'heading_rad': float(self.heading),
-            'heading_deg': float(math.degrees(self.heading) % 360.0),
-            'is_stationary': bool(self.is_stationary),
-            'last_timestamp': float(self.last_timestamp) if self.last_timestamp else None
+            'position': {'x': x, 'y': y},
+            'velocity': {'vx': vx, 'vy': vy, 'speed': math.hypot(vx, vy)},
+            'heading_rad': heading,
+            'heading_deg': self.heading_deg(),
+            'is_stationary': self.is_stationary,
+            'last_timestamp': self.last_timestamp if self.last_timestamp else None
         }
 
+    def get_history(self):
+        """
+        Returns the per-sample diagnostics as a dict of numpy arrays, one per
+        field in HISTORY_FIELDS, all of length history_len and oldest first
+        (read-only; views unless the ring has wrapped, copies after).
+        """
+        n = self.history_len
+        start = self._history_next if self._history_next < n else 0
+        columns = {}
+        for name, column in self._history.items():
+            if start:
+                view = np.concatenate((column[start:n], column[:start]))
+            else:
+                view = column[:n]
+            view.flags.writeable = False
+            columns[name] = view
+        return columns
+
+    @property
+    def history(self):
+        """Per-sample diagnostics as a list of dicts (built on demand; prefer get_history)."""
+        columns = self.get_history()
+        names = list(columns)
+        return [dict(zip(names, row)) for row in zip(*(columns[name].tolist() for name in names))]
+
+    def _grow_history(self):
+        capacity = min(2 * len(self._history['t']), self.history_maxlen)
+        for name, column in self._history.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.history_len] = column[:self.history_len]
+            self._history[name] = grown
+
     def reset(self, pos=(0.0, 0.0), heading_rad=0.0):
-        self.__init__(initial_position=pos, initial_heading_rad=heading_rad, sample_rate_hz=self.sample_hz)
+        self.__init__(initial_position=pos, initial_heading_rad=heading_rad, sample_rate_hz=self.sample_hz,
+                      history_maxlen=self.history_maxlen)
 
 
 # ----------------------------
@@ -373,7 +784,7 @@ class AdvancedTrailTracker:
 
         # Map old parameter names to new ones for compatibility
         self.accel_move_threshold = 0.1  # Not used in new implementation, kept for compatibility
-        self.accel_deadzone = 0.01       # Not used in new implementation, kept for compatibility
+        self.accel_deadzone = self.imu.accel_deadzone
         self.velocity_threshold = self.imu.velocity_threshold
         self.stationary_threshold = self.imu.accel_std_threshold  # Map to accel_std_threshold
         self.velocity_damping = self.imu.velocity_damping
@@ -393,8 +804,10 @@ class AdvancedTrailTracker:
             gyro_z: Yaw rate (rad/s) - only z-axis gyro needed for 2D tracking
             timestamp: Timestamp in seconds (float)
             mag_x, mag_y, mag_z: Optional magnetometer data (uT)
+
+        Returns a TrackerState; call get_state() for the JSON-style dict.
         """
-        state = self.imu.update(
+        state = self.imu.update_fast(
             accel_x, accel_y, accel_z,
             0.0, 0.0, gyro_z,
             timestamp,
@@ -403,6 +816,26 @@ class AdvancedTrailTracker:
 
         return state
 
+    def replay(self, log_array):
+        """
+        Feed a recorded log through the tracker in one call (same result as
+        calling update() per row; see IMUDeadReckoningFixed.update_batch).
+
+        Args:
+            log_array: (N, 5) rows of accel_x, accel_y, accel_z, gyro_z, timestamp (s),
+                or (N, 8) with mag_x, mag_y, mag_z appended
+
+        Returns the state dict after the last row.
+        """
+        log_array = np.asarray(log_array, dtype=float)
+        if log_array.ndim != 2 or log_array.shape[1] not in (5, 8):
+            raise ValueError("log_array must have shape (N, 5) or (N, 8)")
+
+        gyro = np.zeros((len(log_array), 3))
+        gyro[:, 2] = log_array[:, 3]
+        mag = log_array[:, 5:8] if log_array.shape[1] == 8 else None
+        return self.imu.update_batch(log_array[:, 0:3], gyro, log_array[:, 4], mag)
+
     @property
     def position(self):
         """Get current position."""
@@ -432,16 +865,17 @@ class AdvancedTrailTracker:
         Get trail data for visualization.
         Returns a dict with 'path' containing list of position points.
         """
-        path = []
-        if self.imu.history:
-            for entry in self.imu.history:
-                path.append({
-                    'x': entry['pos_x'],
-                    'y': entry['pos_y'],
-                    't': entry['t'],
-                    'speed': entry['speed'],
-                    'heading': entry['heading_deg']
-                })
+        history = self.imu.get_history()
+        path = [
+            {'x': x, 'y': y, 't': t, 'speed': speed, 'heading': heading}
+            for x, y, t, speed, heading in zip(
+                history['pos_x'].tolist(),
+                history['pos_y'].tolist(),
+                history['t'].tolist(),
+                history['speed'].tolist(),
+                history['heading_deg'].tolist(),
+            )
+        ]
 
         return {
             'path': path,
@@ -3,12 +3,13 @@ BRAMPS - IMU & Magnetometer Data Collection Server
 Flask server to receive sensor data from mobile devices
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 import json
 import logging
 from datetime import datetime
 import os
+import queue
 import socket
 import threading
 from threading import Lock
@@ -54,6 +55,11 @@ stats = {
 # Store recent data for debugging (last 100 packets)
 recent_data = []
 recent_data_lock = threading.Lock()  # Thread safety for recent_data
+recent_data_cond = threading.Condition(recent_data_lock)  # Wakes /stream subscribers
+recent_data_seq = 0  # Total packets ever appended to recent_data
+
+# Monotonic clock reading at the first packet, for packets_per_second
+first_packet_monotonic = None
 
 # Create an instance of the AdvancedTrailTracker
 # Expected data rate in Hz (50-100 Hz recommended)
@@ -74,13 +80,19 @@ def log_imu_data(packet_num, source, sensor_data, accel_mag, gyro_mag, mag_mag):
     file_handler.stream.flush()
     
     # Log to console without emojis (ASCII-safe)
-    logger.info(f"IMU Packet #{packet_num} [{source}]")
-    logger.info(f"   Accelerometer: X={sensor_data['accel_x']:+7.3f}, Y={sensor_data['accel_y']:+7.3f}, Z={sensor_data['accel_z']:+7.3f} (|a|={accel_mag:.3f} m/s²)")
-    logger.info(f"   Gyroscope:     X={sensor_data['gyro_x']:+7.3f}, Y={sensor_data['gyro_y']:+7.3f}, Z={sensor_data['gyro_z']:+7.3f} (|w|={gyro_mag:.3f} rad/s)")
-    logger.info(f"   Magnetometer:  X={sensor_data['mag_x']:+7.3f}, Y={sensor_data['mag_y']:+7.3f}, Z={sensor_data['mag_z']:+7.3f} (|B|={mag_mag:.3f} uT)")
+    # %-style args are only formatted if INFO is enabled; skip the whole block otherwise
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info("IMU Packet #%s [%s]", packet_num, source)
+    logger.info("   Accelerometer: X=%+7.3f, Y=%+7.3f, Z=%+7.3f (|a|=%.3f m/s²)",
+                sensor_data['accel_x'], sensor_data['accel_y'], sensor_data['accel_z'], accel_mag)
+    logger.info("   Gyroscope:     X=%+7.3f, Y=%+7.3f, Z=%+7.3f (|w|=%.3f rad/s)",
+                sensor_data['gyro_x'], sensor_data['gyro_y'], sensor_data['gyro_z'], gyro_mag)
+    logger.info("   Magnetometer:  X=%+7.3f, Y=%+7.3f, Z=%+7.3f (|B|=%.3f uT)",
+                sensor_data['mag_x'], sensor_data['mag_y'], sensor_data['mag_z'], mag_mag)
     if 'latency_ms' in sensor_data:
-        logger.info(f"   Latency: {sensor_data['latency_ms']} ms")
-    logger.info(f"   Rate: {stats['packets_per_second']:.1f} packets/sec | Total: {stats['total_packets']} packets")
+        logger.info("   Latency: %s ms", sensor_data['latency_ms'])
+    logger.info("   Rate: %.1f packets/sec | Total: %s packets", stats['packets_per_second'], stats['total_packets'])
     logger.info("-" * 60)
 
 def process_sensor_data(data, source='HTTP'):
@@ -92,10 +104,16 @@ def process_sensor_data(data, source='HTTP'):
         data: Dictionary containing sensor data
         source: Source of the data ('HTTP' or 'UDP')
     """
+    global recent_data_seq, first_packet_monotonic
+
     try:
+        # Wall-clock receive time, read once per packet
+        received_at = datetime.now()
+        received_ms = int(received_at.timestamp() * 1000)
+
         # Log raw data for debugging (first packet only, or if all zeros)
-        if stats['total_packets'] == 0 or (stats['total_packets'] % 50 == 0):
-            logger.info(f"Raw data received [{source}]: {json.dumps(data, indent=2)[:500]}")
+        if (stats['total_packets'] == 0 or stats['total_packets'] % 50 == 0) and logger.isEnabledFor(logging.INFO):
+            logger.info("Raw data received [%s]: %s", source, json.dumps(data, indent=2)[:500])
         
         # Flexible field name mapping - handle different naming conventions
         # Try multiple possible field names for each sensor
@@ -122,8 +140,8 @@ def process_sensor_data(data, source='HTTP'):
             'mag_x': get_value(data, 'mag_x', 'magX', 'magneticFieldX', 'magnetic_field_x', 'mx', 'm_x', 'magnetometerX'),
             'mag_y': get_value(data, 'mag_y', 'magY', 'magneticFieldY', 'magnetic_field_y', 'my', 'm_y', 'magnetometerY'),
             'mag_z': get_value(data, 'mag_z', 'magZ', 'magneticFieldZ', 'magnetic_field_z', 'mz', 'm_z', 'magnetometerZ'),
-            'timestamp': data.get('timestamp', data.get('time', int(datetime.now().timestamp() * 1000))),
-            'server_received_at': datetime.now().isoformat(),
+            'timestamp': data['timestamp'] if 'timestamp' in data else data.get('time', received_ms),
+            'server_received_at': received_at.isoformat(),
             'source': source  # Track data source
         }
         
@@ -131,22 +149,24 @@ def process_sensor_data(data, source='HTTP'):
         if (sensor_data['accel_x'] == 0.0 and sensor_data['accel_y'] == 0.0 and sensor_data['accel_z'] == 0.0 and
             sensor_data['gyro_x'] == 0.0 and sensor_data['gyro_y'] == 0.0 and sensor_data['gyro_z'] == 0.0 and
             sensor_data['mag_x'] == 0.0 and sensor_data['mag_y'] == 0.0 and sensor_data['mag_z'] == 0.0):
-            logger.warning(f"All sensor values are zero! Raw data keys: {list(data.keys())}")
-            logger.warning(f"Sample values: {json.dumps({k: v for k, v in list(data.items())[:10]})}")
+            if logger.isEnabledFor(logging.WARNING):
+                logger.warning("All sensor values are zero! Raw data keys: %s", list(data.keys()))
+                logger.warning("Sample values: %s", json.dumps({k: v for k, v in list(data.items())[:10]}))
         
         # Calculate latency (if client timestamp provided)
         if 'timestamp' in data:
             client_time = data['timestamp']
-            server_time = int(datetime.now().timestamp() * 1000)
-            latency = server_time - client_time
+            latency = received_ms - client_time
             sensor_data['latency_ms'] = latency
         
         # Update statistics
         stats['total_packets'] += 1
-        current_time = datetime.now()
+        current_time = received_at
+        current_monotonic = time.monotonic()
         
         if stats['first_packet_time'] is None:
             stats['first_packet_time'] = current_time
+            first_packet_monotonic = current_monotonic
         
         stats['last_packet_time'] = current_time
         stats['last_data'] = sensor_data
@@ -160,8 +180,9 @@ def process_sensor_data(data, source='HTTP'):
             stats['last_http_time'] = current_time
         
         # Calculate packets per second (simple moving average)
-        if stats['first_packet_time']:
-            elapsed = (current_time - stats['first_packet_time']).total_seconds()
+        # Monotonic clock: immune to wall-clock jumps and cheaper than datetime arithmetic
+        if first_packet_monotonic is not None:
+            elapsed = current_monotonic - first_packet_monotonic
             if elapsed > 0:
                 stats['packets_per_second'] = stats['total_packets'] / elapsed
         
@@ -181,15 +202,17 @@ def process_sensor_data(data, source='HTTP'):
         )
 
         # Store recent data (keep last 100 packets) - Thread safe
-        with recent_data_lock:
+        with recent_data_cond:
             recent_data.append(sensor_data)
             if len(recent_data) > 100:
                 recent_data.pop(0)
             current_length = len(recent_data)
+            recent_data_seq += 1
+            recent_data_cond.notify_all()
         
         # Debug logging for data storage
         if stats['total_packets'] % 10 == 0:
-            logger.info(f"Data stored - recent_data length: {current_length}, total_packets: {stats['total_packets']}")
+            logger.info("Data stored - recent_data length: %s, total_packets: %s", current_length, stats['total_packets'])
         
         # Enhanced IMU logging - every 5th packet for better monitoring
         if stats['total_packets'] % 5 == 0:
@@ -206,10 +229,46 @@ def process_sensor_data(data, source='HTTP'):
         logger.error(f"Error processing sensor data: {e}", exc_info=True)
         return None
 
+def udp_worker(packet_queue):
+    """
+    Decode and process UDP packets handed over by udp_listener, in arrival order
+    """
+    while True:
+        data, addr = packet_queue.get()
+        
+        # Decode and parse JSON
+        try:
+            data_str = data.decode('utf-8')
+            sensor_json = json.loads(data_str)
+            
+            # Log first UDP packet to see format
+            if stats['udp_packets'] == 0:
+                logger.info(f"First UDP packet received from {addr}")
+                logger.info(f"Raw JSON keys: {list(sensor_json.keys())}")
+                logger.info(f"Sample values: {json.dumps({k: v for k, v in list(sensor_json.items())[:15]}, indent=2)}")
+            
+            # Process the sensor data
+            process_sensor_data(sensor_json, source='UDP')
+            
+        except json.JSONDecodeError as e:
+            logger.warning(f"Invalid JSON from {addr}: {e}")
+            logger.warning(f"Received data (first 200 chars): {data_str[:200]}")
+        except UnicodeDecodeError as e:
+            logger.warning(f"Invalid encoding from {addr}: {e}")
+        except Exception as e:
+            logger.error(f"Error processing UDP packet from {addr}: {e}")
+
 def udp_listener(udp_port=8888):
     """
     UDP listener thread to receive sensor data from mobile apps
+
+    Only receives; parsing, dead reckoning and logging run on a udp_worker
+    thread so a slow packet never delays the next recvfrom.
     """
+    packet_queue = queue.Queue(maxsize=1000)
+    dropped_packets = 0
+    threading.Thread(target=udp_worker, args=(packet_queue,), daemon=True).start()
+    
     try:
         # Create UDP socket
         udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -224,27 +283,13 @@ def udp_listener(udp_port=8888):
                 # Receive UDP packet (max 4096 bytes)
                 data, addr = udp_socket.recvfrom(4096)
                 
-                # Decode and parse JSON
                 try:
-                    data_str = data.decode('utf-8')
-                    sensor_json = json.loads(data_str)
-                    
-                    # Log first UDP packet to see format
-                    if stats['udp_packets'] == 0:
-                        logger.info(f"First UDP packet received from {addr}")
-                        logger.info(f"Raw JSON keys: {list(sensor_json.keys())}")
-                        logger.info(f"Sample values: {json.dumps({k: v for k, v in list(sensor_json.items())[:15]}, indent=2)}")
-                    
-                    # Process the sensor data
-                    process_sensor_data(sensor_json, source='UDP')
-                    
-                except json.JSONDecodeError as e:
-                    logger.warning(f"Invalid JSON from {addr}: {e}")
-                    logger.warning(f"Received data (first 200 chars): {data_str[:200]}")
-                except UnicodeDecodeError as e:
-                    logger.warning(f"Invalid encoding from {addr}: {e}")
-                except Exception as e:
-                    logger.error(f"Error processing UDP packet from {addr}: {e}")
+                    packet_queue.put_nowait((data, addr))
+                except queue.Full:
+                    # Worker is ~10 s behind at 100 Hz; shed load rather than grow without bound
+                    dropped_packets += 1
+                    if dropped_packets % 100 == 1:
+                        logger.warning(f"UDP worker backlog full, dropped {dropped_packets} packets so far")
                     
             except socket.error as e:
                 logger.error(f"UDP socket error: {e}")
@@ -277,6 +322,8 @@ def index():
                 'endpoints': {
                     '/': 'GET - iPhone IMU Monitor (HTML interface)',
                     '/imu': 'POST - Receive IMU sensor data',
+                    '/imu_batch': 'POST - Receive a list of IMU packets',
+                    '/stream': 'GET - Server-Sent Events stream of incoming packets',
                     '/stats': 'GET - Get server statistics',
                     '/health': 'GET - Health check',
                     '/debug': 'GET - Debug information'
@@ -444,6 +491,57 @@ def receive_imu_data():
         logger.error(f"Unexpected error: {e}", exc_info=True)
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
+@app.route('/imu_batch', methods=['POST', 'OPTIONS'])
+def receive_imu_batch():
+    """
+    Receive several IMU packets in a single request
+
+    Clients that sample faster than they can afford round-trips can buffer
+    packets for a short window and POST them together instead of one
+    request per packet.
+
+    Expected JSON format: either a list of packets in the /imu format, or
+    {"packets": [...]}. Packets are processed in order.
+    """
+    if request.method == 'OPTIONS':
+        # Handle preflight request
+        return '', 200
+
+    try:
+        data = request.get_json()
+
+        if isinstance(data, dict):
+            data = data.get('packets')
+
+        if not data or not isinstance(data, list):
+            logger.warning("Received empty or malformed batch")
+            return jsonify({'error': 'Expected a non-empty list of packets'}), 400
+
+        accepted = 0
+        rejected = 0
+        for packet in data:
+            if not isinstance(packet, dict) or 'timestamp' not in packet:
+                rejected += 1
+                continue
+            if process_sensor_data(packet) is None:
+                rejected += 1
+            else:
+                accepted += 1
+
+        if rejected:
+            logger.warning(f"Batch: rejected {rejected} of {len(data)} packets")
+
+        return jsonify({
+            'status': 'success',
+            'accepted': accepted,
+            'rejected': rejected,
+            'packet_number': stats['total_packets']
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}", exc_info=True)
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
 @app.route('/stats', methods=['GET'])
 def get_stats():
     """Get server statistics"""
@@ -481,20 +579,55 @@ def get_recent_data():
         data_to_return = recent_data[-limit:] if recent_data else []
     
     # Debug logging with more details
-    logger.info(f"Recent data request - limit: {limit}, available packets: {data_length}")
-    logger.info(f"Total packets received: {stats['total_packets']}, UDP packets: {stats['udp_packets']}")
+    logger.info("Recent data request - limit: %s, available packets: %s", limit, data_length)
+    logger.info("Total packets received: %s, UDP packets: %s", stats['total_packets'], stats['udp_packets'])
     
     if data_length > 0:
-        logger.info(f"Latest packet sample: {json.dumps(data_to_return[-1], indent=2)[:300]}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Latest packet sample: %s", json.dumps(data_to_return[-1], indent=2)[:300])
     else:
         logger.warning("No recent data available despite receiving packets!")
-        logger.info(f"Stats: {json.dumps(stats, default=str, indent=2)}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Stats: %s", json.dumps(stats, default=str, indent=2))
     
     return jsonify({
         'count': min(data_length, limit),
         'data': data_to_return
     })
 
+@app.route('/stream', methods=['GET'])
+def stream_recent_data():
+    """Push each new sensor packet to the client as a Server-Sent Event.
+
+    Replaces polling /recent: every packet is delivered once, as soon as it
+    arrives. A comment line is sent every 15 s of silence to keep proxies
+    from closing the connection.
+    """
+    def generate():
+        with recent_data_cond:
+            last_seq = recent_data_seq
+
+        # Flush headers right away so the client sees the stream open
+        yield "retry: 2000\n\n"
+
+        while True:
+            with recent_data_cond:
+                recent_data_cond.wait_for(lambda: recent_data_seq != last_seq, timeout=15.0)
+                # A slow client may fall more than 100 packets behind; it only gets what is still buffered
+                missed = min(recent_data_seq - last_seq, len(recent_data))
+                packets = recent_data[-missed:] if missed else []
+                last_seq = recent_data_seq
+
+            if not packets:
+                yield ": keep-alive\n\n"
+                continue
+
+            for packet in packets:
+                yield f"data: {json.dumps(packet)}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/trail_tracker')
 def trail_tracker_page():
     """Serve the trail tracker page."""